@@ -1,6 +1,8 @@
 import logging
 
-logging.basicConfig(
-    format='[%(asctime)s] [%(process)d] [%(name)s] [%(levelname)s] '
-           '%(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S +0000', level=logging.DEBUG)
+from basil_common import logging_support
+
+# Like logging.basicConfig, leave logging alone if the application has
+# already set it up
+if not logging.getLogger().handlers:
+    logging_support.configure()
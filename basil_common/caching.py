@@ -1,10 +1,14 @@
 import json
 import logging
 import threading
+import zlib
 
 import redis
 import time
 
+from basil_common.compat import queue
+from basil_common.compat import TEXT_TYPE
+
 
 LOG = logging.getLogger(__name__)
 
@@ -22,10 +26,31 @@ def connect_to_cache():
 
 
 class FactCache(object):
+    """Cache of facts kept in Redis and loaded in bulk on a miss
+
+    By default each fact is a Redis key of its own. When `buckets` is given,
+    facts are instead packed as fields into that many Redis hashes, chosen by
+    the key. Each hash expires as a whole `timeout_seconds` after it was
+    created or last bulk loaded.
+
+    Buckets only save memory while Redis keeps each hash in its compact
+    encoding, that is while it holds no more than hash-max-ziplist-entries
+    fields (512 by default) of no more than hash-max-ziplist-value bytes (64
+    by default). Size `buckets` to at least the number of facts divided by
+    the entry limit, with some headroom as keys do not spread evenly.
+    """
     IS_JSON = 'JSON::'
+    BUCKET_MARK = '#'
+    # Set a field, starting the bucket's expiry only if it has none yet
+    SET_IN_BUCKET = """
+        redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+        if redis.call('TTL', KEYS[1]) < 0 then
+            redis.call('EXPIRE', KEYS[1], ARGV[3])
+        end
+        """
 
     def __init__(self, redis_conn, prefix, timeout_seconds=3600, loader=None,
-                 preload=False, debug=False):
+                 preload=False, debug=False, buckets=None):
         self._redis = redis_conn
         self._prefix = prefix
         self.timeout_seconds = timeout_seconds
@@ -33,10 +58,18 @@ class FactCache(object):
         self._load_op = None
         self._loading_lock = threading.BoundedSemaphore()
         self._debug = debug
+        self._buckets = buckets
+        if redis_conn and buckets:
+            self._set_in_bucket = redis_conn.register_script(
+                self.SET_IN_BUCKET)
 
         if redis_conn and preload:
             self.get('')
 
+    @property
+    def prefix(self):
+        return self._prefix
+
     @property
     def is_available(self):
         return self._redis.ping()
@@ -46,7 +79,7 @@ class FactCache(object):
         acquired_lock = False
         try:
             acquired_lock = self._loading_lock.acquire(blocking=False)
-            return not acquired_lock or (self._is_load_op_alive())
+            return not acquired_lock or bool(self._is_load_op_alive())
         finally:
             if acquired_lock:
                 self._loading_lock.release()
@@ -55,16 +88,29 @@ class FactCache(object):
         self.set(key, value)
 
     def set(self, key, value):
-        cache_key = self._compound_key(key)
         value = self._pickle(value)
+        if self._buckets:
+            return self._set_in_bucket(keys=[self._bucket_key(key)],
+                                       args=[str(key), value,
+                                             self.timeout_seconds])
+        cache_key = self._compound_key(key)
         return self._redis.setex(cache_key, self.timeout_seconds, value)
 
     def load(self, payload):
         self._load(payload)
 
+    def warm(self):
+        """Run the loader and send its payload to the cache before returning
+
+        Concurrent misses wait for the warm up rather than starting a load of
+        their own.
+        """
+        with self._loading_lock:
+            self._wait_for_loading_op()
+            self._load(self._loader())
+
     def get(self, key, blocking=False):
-        compound_key = self._compound_key(key)
-        found = self._redis.get(compound_key)
+        found = self._read(key)
         if found:
             if self._debug:
                 LOG.info('Cache Hit [%s] for key [%s]', self._prefix, key)
@@ -86,13 +132,27 @@ class FactCache(object):
     def _compound_key(self, key):
         return self._prefix + str(key)
 
+    def _bucket_key(self, key):
+        # Hash the bytes of the key so every Python version picks the same
+        # bucket, masking crc32 which is signed on Python 2
+        if not isinstance(key, (bytes, TEXT_TYPE)):
+            key = str(key)
+        if isinstance(key, TEXT_TYPE):
+            key = key.encode('utf-8')
+        bucket = (zlib.crc32(key) & 0xffffffff) % self._buckets
+        return self._prefix + self.BUCKET_MARK + str(bucket)
+
+    def _read(self, key):
+        if self._buckets:
+            return self._redis.hget(self._bucket_key(key), str(key))
+        return self._redis.get(self._compound_key(key))
+
     def _locked_get(self, key):
         with self._loading_lock:
             self._wait_for_loading_op()
 
             # Try one more time to find the key in the cache
-            compound_key = self._compound_key(key)
-            found = self._redis.get(compound_key)
+            found = self._read(key)
             if found:
                 return self._unpickle(found)
 
@@ -119,8 +179,25 @@ class FactCache(object):
         return self._load_op and self._load_op.is_alive()
 
     def _load(self, payload):
+        if self._buckets:
+            self._load_buckets(payload)
+        else:
+            for key in payload:
+                self.set(key, payload[key])
+
+    def _load_buckets(self, payload):
+        # Send the whole payload in one round trip, restarting the expiry of
+        # every bucket it touches
+        buckets = {}
         for key in payload:
-            self.set(key, payload[key])
+            fields = buckets.setdefault(self._bucket_key(key), {})
+            fields[str(key)] = self._pickle(payload[key])
+
+        pipe = self._redis.pipeline(transaction=False)
+        for bucket_key, fields in buckets.items():
+            pipe.hmset(bucket_key, fields)
+            pipe.expire(bucket_key, self.timeout_seconds)
+        pipe.execute()
 
     def _pickle(self, value):
         if not isinstance(value, str):
@@ -135,3 +212,136 @@ class FactCache(object):
     @staticmethod
     def noop():
         return {}
+
+
+class CacheWarmer(object):
+    """Warm a set of FactCaches concurrently on a bounded pool of threads
+
+    The warmer is ready as soon as every critical cache has loaded, while the
+    remaining caches continue to warm in the background. Critical caches are
+    warmed first. When no critical prefixes are named, every cache is
+    critical.
+
+    A cache which fails to warm is retried, waiting `backoff` seconds before
+    the first retry and twice as long before each one after. A cache which
+    still fails after `retries` retries is left cold and reported in
+    `failures`; if it is critical the warmer never becomes ready, and the
+    service must be restarted or warmed again with a new CacheWarmer.
+
+    :param caches: :class:`FactCache` instances to warm, normally created
+        with preload=False
+    :param critical: prefixes of the caches required before being ready
+    :param workers: maximum number of caches to warm at once
+    :param retries: maximum times to retry warming a failed cache
+    :param backoff: seconds to wait before the first retry
+    :raises ValueError: if a critical prefix is not that of any cache
+    """
+    def __init__(self, caches, critical=None, workers=4, retries=3,
+                 backoff=1.0):
+        caches = list(caches)
+        prefixes = set(c.prefix for c in caches)
+        if critical is None:
+            critical = prefixes
+        unknown = set(critical) - prefixes
+        if unknown:
+            raise ValueError('Unknown critical prefixes: %s' % sorted(unknown))
+        self._critical = set(critical)
+        self._caches = sorted(caches,
+                              key=lambda c: c.prefix not in self._critical)
+        self._workers = max(1, min(workers, len(caches)))
+        self._retries = retries
+        self._backoff = backoff
+        self._lock = threading.Lock()
+        self._awaiting = set(self._critical)
+        self._remaining = len(caches)
+        self._ready = threading.Event()
+        self._complete = threading.Event()
+        self.timings = {}
+        self.failures = {}
+
+        if not self._awaiting:
+            self._ready.set()
+        if not self._remaining:
+            self._complete.set()
+
+    @property
+    def is_ready(self):
+        return self._ready.is_set()
+
+    @property
+    def is_complete(self):
+        return self._complete.is_set()
+
+    @property
+    def report(self):
+        with self._lock:
+            return {'ready': self.is_ready,
+                    'complete': self.is_complete,
+                    'timings': dict(self.timings),
+                    'failures': dict((p, str(ex)) for p, ex
+                                     in self.failures.items())}
+
+    def start(self):
+        pending = queue.Queue()
+        for cache in self._caches:
+            pending.put(cache)
+
+        for n in range(self._workers):
+            named = 'CacheWarmer[%d]' % n
+            worker = threading.Thread(target=self._work, args=(pending,),
+                                      name=named)
+            worker.daemon = True
+            worker.start()
+        return self
+
+    def wait(self, timeout=None, critical_only=True):
+        """Block until the warmer is ready, or complete
+
+        :param timeout: seconds to wait, or None to wait indefinitely
+        :param critical_only: if False wait for every cache to be warmed
+        :return: True if the awaited state was reached, otherwise False
+        """
+        event = self._ready if critical_only else self._complete
+        event.wait(timeout)
+        return event.is_set()
+
+    def _work(self, pending):
+        while True:
+            try:
+                cache = pending.get_nowait()
+            except queue.Empty:
+                return
+            self._warm(cache)
+
+    def _warm(self, cache):
+        try:
+            for attempt in range(self._retries + 1):
+                if attempt:
+                    time.sleep(self._backoff * 2 ** (attempt - 1))
+                if self._try_warm(cache):
+                    break
+        finally:
+            with self._lock:
+                self._remaining -= 1
+                if not self._remaining:
+                    self._complete.set()
+
+    def _try_warm(self, cache):
+        started = time.time()
+        try:
+            cache.warm()
+        except Exception as ex:
+            LOG.exception('Cache warm up failed [%s]', cache.prefix)
+            with self._lock:
+                self.failures[cache.prefix] = ex
+            return False
+
+        elapsed = time.time() - started
+        LOG.info('Cache warmed [%s] in %.3fs', cache.prefix, elapsed)
+        with self._lock:
+            self.failures.pop(cache.prefix, None)
+            self.timings[cache.prefix] = elapsed
+            self._awaiting.discard(cache.prefix)
+            if not self._awaiting:
+                self._ready.set()
+        return True
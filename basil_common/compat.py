@@ -0,0 +1,11 @@
+try:
+    import Queue as queue
+except ImportError:  # pragma: no cover
+    import queue
+
+try:
+    TEXT_TYPE = unicode
+except NameError:  # pragma: no cover
+    TEXT_TYPE = str
+
+__all__ = ['queue', 'TEXT_TYPE']
@@ -1,8 +1,20 @@
+import base64
+import datetime
+import decimal
+import json
+
+from sqlalchemy import and_
 from sqlalchemy import create_engine
 from sqlalchemy import exc
+from sqlalchemy import or_
 from sqlalchemy.orm import scoping
 from sqlalchemy.orm import sessionmaker
 
+from basil_common.compat import TEXT_TYPE
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+DATE_FORMAT = '%Y-%m-%d'
+
 
 class SessionManager:
     """Falcon Middleware to manage SQLAlchemy Sessions
@@ -82,3 +94,112 @@ def rollback_on_exception(app):
         raise
 
     app.add_error_handler(exc.SQLAlchemyError, rollback_handler)
+
+
+def iterate_in_chunks(query, chunk_size=1000):
+    """Iterate the results of a query as lists of at most chunk_size rows
+
+    Rows are fetched from a server-side cursor where the driver supports one,
+    and only one chunk of results is built in memory at a time. The chunks
+    should be consumed before the session is committed or closed, as by a
+    SessionManager at the end of a request.
+
+    :param query: a :class:`sqlalchemy.orm.Query` to stream results of
+    :param chunk_size: number of rows fetched and yielded at a time
+    :return: a generator of lists of rows
+    """
+    results = query.execution_options(stream_results=True)
+    chunk = []
+    for row in results.yield_per(chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def keyset_page(query, columns, token=None, page_size=100, descending=False):
+    """Fetch one page of a query, seeking past the previous page by key
+
+    The query is ordered by columns, which together must uniquely identify a
+    row, and filtered to rows after the position encoded in token. Unlike
+    OFFSET, the cost of a page does not grow with how deep into the results
+    it is.
+
+    :param query: a :class:`sqlalchemy.orm.Query` without an ORDER BY
+    :param columns: mapped attributes or columns to order and seek by, whose
+        values are JSON serializable, naive datetimes, dates or Decimals
+    :param token: continuation token from the previous page, or None for the
+        first page
+    :param page_size: maximum number of rows in the page
+    :param descending: order by the columns in descending order
+    :return: a tuple of the list of rows and the continuation token for the
+        next page, which is None on the last page
+    :raises ValueError: if the token is not one issued for these columns
+    """
+    if token is not None:
+        query = query.filter(_after(columns, _decode_token(token, columns),
+                                    descending))
+    ordering = [c.desc() if descending else c.asc() for c in columns]
+    rows = query.order_by(*ordering).limit(page_size + 1).all()
+
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, _encode_token([getattr(rows[-1], c.key) for c in columns])
+
+
+def _after(columns, values, descending):
+    # Expanded form of (c1, c2, ...) > (v1, v2, ...) which works on all
+    # databases, unlike row value comparisons
+    clauses = []
+    for n, column in enumerate(columns):
+        matched = [c == v for c, v in zip(columns[:n], values[:n])]
+        beyond = column < values[n] if descending else column > values[n]
+        clauses.append(and_(*(matched + [beyond])))
+    return or_(*clauses)
+
+
+def _encode_token(values):
+    encoded = json.dumps(values, default=_tag_value).encode('utf-8')
+    return base64.urlsafe_b64encode(encoded).decode('ascii')
+
+
+def _decode_token(token, columns):
+    if not isinstance(token, (bytes, TEXT_TYPE)):
+        raise ValueError('Invalid continuation token: %r' % token)
+    try:
+        if not isinstance(token, bytes):
+            token = token.encode('ascii')
+        values = json.loads(base64.urlsafe_b64decode(token).decode('utf-8'),
+                            object_hook=_untag_value)
+    except (TypeError, ValueError, decimal.InvalidOperation):
+        raise ValueError('Invalid continuation token: %r' % token)
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError('Invalid continuation token: %r' % token)
+    return values
+
+
+def _tag_value(value):
+    # Key values JSON has no type for are written as tagged strings
+    if isinstance(value, datetime.datetime):
+        return {'datetime': value.strftime(DATETIME_FORMAT)}
+    if isinstance(value, datetime.date):
+        return {'date': value.strftime(DATE_FORMAT)}
+    if isinstance(value, decimal.Decimal):
+        return {'decimal': str(value)}
+    raise TypeError('Cannot encode %r in a continuation token' % value)
+
+
+def _untag_value(tagged):
+    if len(tagged) == 1:
+        if 'datetime' in tagged:
+            return datetime.datetime.strptime(tagged['datetime'],
+                                              DATETIME_FORMAT)
+        if 'date' in tagged:
+            return datetime.datetime.strptime(tagged['date'],
+                                              DATE_FORMAT).date()
+        if 'decimal' in tagged:
+            return decimal.Decimal(tagged['decimal'])
+    raise ValueError('Unknown value in continuation token: %r' % tagged)
@@ -1,9 +1,13 @@
 import datetime
 import hashlib
 import json
+import threading
+import time
 
 import falcon
 
+from basil_common.compat import TEXT_TYPE
+
 
 USE_CACHE_CONTROL = 'USE_CACHE_CONTROL'
 USE_ETAG = 'USE_ETAG'
@@ -29,18 +33,93 @@ def is_cacheable(status):
     return code in [200, 203, 206, 300, 301, 410]
 
 
+class JsonEncoder(object):
+    """Serialize response bodies as compact JSON
+
+    The underlying :class:`json.JSONEncoder` is built once and reused for
+    every call, so encoder settings are not re-parsed per request. By default
+    the output is ASCII only, which lets its length double as the length of
+    the encoded response.
+
+    :param settings: keyword arguments for :class:`json.JSONEncoder`
+    """
+    content_type = 'application/json; charset=utf-8'
+
+    def __init__(self, **settings):
+        settings.setdefault('separators', (',', ':'))
+        self._ascii_only = settings.setdefault('ensure_ascii', True)
+        self._encode = json.JSONEncoder(**settings).encode
+
+    def __call__(self, obj):
+        return self._encode(obj)
+
+    def length(self, encoded):
+        """Determine the byte length of a body produced by this encoder
+
+        :param encoded: output of this encoder
+        :return: length in bytes, or None if it cannot be known cheaply
+        """
+        return len(encoded) if self._ascii_only else None
+
+
+DEFAULT_ENCODER = JsonEncoder()
+
+
 def respond(resp, method='GET', status=falcon.HTTP_200, headers=None,
-            body=None):
+            body=None, encoder=None):
+    """Populate a response with a status, headers and an optional body
+
+    A body of bytes is taken as already encoded and is published as-is, as is
+    any text. Any other body is serialized with the encoder.
+
+    The encoder may be any callable returning bytes or text, such as
+    json.dumps. If it has a `content_type` attribute that is the content type
+    of the response, otherwise JSON is assumed. If it has a `length(encoded)`
+    method, as JsonEncoder does, that gives the Content-Length of text
+    output, which is otherwise left for Falcon to determine.
+
+    :param resp: response being formulated
+    :param method: HTTP method of the request being answered
+    :param status: HTTP Status string for the response
+    :param headers: dict of additional response headers
+    :param body: bytes, text or an object to encode for the response
+    :param encoder: callable to serialize body, defaults to DEFAULT_ENCODER
+    :return: None
+    """
     resp.status = status
     if headers:
         for key, value in headers.iteritems():
             resp.set_header(key, value)
     if status not in [falcon.HTTP_204, falcon.HTTP_304]:
+        if body is not None:
+            body = _encoded_body(resp, body, encoder or DEFAULT_ENCODER)
         if method != 'HEAD':
             resp.body = body
     # else MUST not include body in any other cases
 
 
+def _encoded_body(resp, body, encoder):
+    if isinstance(body, bytes):
+        length = len(body)
+    elif isinstance(body, TEXT_TYPE):
+        # Byte length of text is only known once Falcon encodes it
+        return body
+    else:
+        body = encoder(body)
+        resp.content_type = getattr(encoder, 'content_type',
+                                    JsonEncoder.content_type)
+        if isinstance(body, bytes):
+            length = len(body)
+        elif hasattr(encoder, 'length'):
+            length = encoder.length(body)
+        else:
+            length = None
+
+    if length is not None:
+        resp.set_header('Content-Length', str(length))
+    return body
+
+
 def prod_handler(ex, req, resp, params):
     """Handle exceptions thrown during request processing
 
@@ -71,7 +150,7 @@ def dev_handler(ex, req, resp, params):
     if isinstance(ex, falcon.HTTPError):
         raise
 
-    resp.status = falcon.HTTP_INTERNAL_SERVER_ERROR
+    status = falcon.HTTP_INTERNAL_SERVER_ERROR
 
     import traceback
     trace = traceback.format_exc()
@@ -79,12 +158,32 @@ def dev_handler(ex, req, resp, params):
     if req.client_accepts('text/html'):
         resp.content_type = 'text/html'
         content = ('<!DOCTYPE html><h2>%s</h2>%s<hr><pre>%s</pre>'
-                   % (resp.status, ex.message, trace))
+                   % (status, ex.message, trace))
     else:
-        error = {'status': resp.status, 'message': ex.message,
-                 'description': trace.split('\n')}
-        content = json.dumps(error)
-    resp.body = content
+        content = {'status': status, 'message': ex.message,
+                   'description': trace.split('\n')}
+    respond(resp, method=req.method, status=status, body=content)
+
+
+class ReadinessResource(object):
+    """Falcon Resource reporting whether the service is ready for traffic
+
+    Responds 200 once the warmer is ready and 503 until then, each with the
+    warmer's report as the body.
+
+    :param warmer: a :class:`basil_common.caching.CacheWarmer` or anything
+        else with `is_ready` and `report` properties
+    """
+    def __init__(self, warmer):
+        self._warmer = warmer
+
+    def on_get(self, req, resp):
+        status = (falcon.HTTP_200 if self._warmer.is_ready
+                  else falcon.HTTP_503)
+        respond(resp, method=req.method, status=status,
+                body=self._warmer.report)
+
+    on_head = on_get
 
 
 class InjectorMiddleware(object):
@@ -97,6 +196,107 @@ class InjectorMiddleware(object):
         req.context.update(self._injectables)
 
 
+class AdmissionMiddleware(object):
+    """WSGI Middleware limiting the requests processed at once
+
+    Up to `concurrency` requests are passed to the wrapped application at
+    once. Beyond that, up to `queue_size` requests wait at most
+    `queue_timeout` seconds for a turn, and any others are rejected with a
+    503 and a Retry-After header before they take up database connections or
+    cache loaders.
+
+    It wraps the whole Falcon API rather than being added as Falcon
+    middleware, so a turn is given back however the request ends, even when
+    an error handler raises. A turn is given back once the application
+    returns, before any streamed body is sent.
+
+    :param app: the WSGI application, normally a :class:`falcon.API`
+    :param concurrency: maximum requests processed at once by this process
+    :param queue_size: maximum requests waiting for a turn
+    :param queue_timeout: seconds a request may wait before being rejected
+    :param retry_after: seconds a rejected client is asked to wait
+    :param prioritize_reads: admit waiting GET and HEAD requests before
+        any other waiting requests
+    """
+    def __init__(self, app, concurrency=8, queue_size=16, queue_timeout=0.1,
+                 retry_after=1, prioritize_reads=False):
+        self._app = app
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._prioritize_reads = prioritize_reads
+        self._turns = threading.Condition()
+        self.active = 0
+        self._waiting = {True: 0, False: 0}
+        self.queued = 0
+        self.shed = 0
+
+    @property
+    def waiting(self):
+        return self._waiting[True] + self._waiting[False]
+
+    def __call__(self, env, start_response):
+        if not self._enter(self._is_priority(env)):
+            return self._reject(start_response)
+        try:
+            return self._app(env, start_response)
+        finally:
+            self._leave()
+
+    def _is_priority(self, env):
+        return (self._prioritize_reads and
+                env.get('REQUEST_METHOD') in ['GET', 'HEAD'])
+
+    def _enter(self, priority):
+        with self._turns:
+            if not self._can_enter(priority):
+                if not self._wait_for_turn(priority):
+                    self.shed += 1
+                    return False
+            self.active += 1
+            return True
+
+    def _leave(self):
+        with self._turns:
+            self.active -= 1
+            self._turns.notify_all()
+
+    def _can_enter(self, priority):
+        if self.active >= self.concurrency:
+            return False
+        # Waiting reads go before any other request when prioritized
+        return priority or not self._waiting[True]
+
+    def _wait_for_turn(self, priority):
+        if self.waiting >= self.queue_size:
+            return False
+
+        self.queued += 1
+        self._waiting[priority] += 1
+        try:
+            deadline = time.time() + self.queue_timeout
+            while not self._can_enter(priority):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._turns.wait(remaining)
+            return True
+        finally:
+            self._waiting[priority] -= 1
+
+    def _reject(self, start_response):
+        body = DEFAULT_ENCODER({
+            'title': 'Service Unavailable',
+            'description': 'Too many requests, try again shortly.'})
+        body = body.encode('utf-8')
+        start_response(falcon.HTTP_503, [
+            ('Content-Type', DEFAULT_ENCODER.content_type),
+            ('Content-Length', str(len(body))),
+            ('Retry-After', str(self.retry_after))])
+        return [body]
+
+
 class CacheControlMiddleware(object):
     def __init__(self, duration_seconds=3600):
         self.duration_seconds = duration_seconds
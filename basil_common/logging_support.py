@@ -0,0 +1,172 @@
+import atexit
+import copy
+import logging
+import os
+import threading
+
+from basil_common.compat import queue
+
+
+LOG_FORMAT = ('[%(asctime)s] [%(process)d] [%(name)s] [%(levelname)s] '
+              '%(message)s')
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S +0000'
+
+LOG = logging.getLogger(__name__)
+
+_configured = {}
+
+
+class QueueHandler(logging.Handler):
+    """Logging Handler which hands records off to a bounded queue
+
+    Records are rendered to their final message on the logging thread, then
+    enqueued without blocking. When the queue is full the record is dropped
+    and counted rather than slowing down the caller.
+
+    If the process has forked since the handler was created, the first record
+    logged in the child gives it a fresh queue and restarts the listener, as
+    the listener thread is not inherited by the child.
+
+    :param records: a bounded :class:`Queue.Queue` shared with a
+        :class:`QueueListener`
+    :param listener: the :class:`QueueListener` reading records, if it should
+        be restarted after a fork
+    """
+    def __init__(self, records, listener=None):
+        logging.Handler.__init__(self)
+        self._records = records
+        self._listener = listener
+        self._pid = os.getpid()
+        self._dropped_lock = threading.Lock()
+        self.dropped = 0
+
+    def emit(self, record):
+        try:
+            if self._listener and self._pid != os.getpid():
+                self._after_fork()
+            self._records.put_nowait(self.prepare(record))
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def prepare(self, record):
+        # Merge args and exception text into the message of a copy, so the
+        # queued record holds no references to objects which may change
+        # before it is written and other handlers still see the original
+        msg = self.format(record)
+        record = copy.copy(record)
+        record.msg = msg
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def _after_fork(self):
+        self._pid = os.getpid()
+        self._records = queue.Queue(self._records.maxsize)
+        self._listener.restart(self._records)
+
+
+class QueueListener(object):
+    """Writes records from a queue to handlers on a background thread
+
+    :param records: the :class:`Queue.Queue` a :class:`QueueHandler` feeds
+    :param handlers: :class:`logging.Handler` instances to write records to
+    """
+    _sentinel = None
+
+    def __init__(self, records, *handlers):
+        self._records = records
+        self.handlers = handlers
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor,
+                                        name='QueueListener')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def restart(self, records):
+        """Start reading from a new queue, as in a child process after fork
+
+        :param records: the :class:`Queue.Queue` to read records from
+        """
+        self._records = records
+        self._thread = None
+        self.start()
+
+    def stop(self):
+        if self._thread and self._thread.is_alive():
+            self._records.put(self._sentinel)
+            self._thread.join()
+            self._thread = None
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _monitor(self):
+        while True:
+            record = self._records.get()
+            if record is self._sentinel:
+                break
+            self.handle(record)
+
+
+def configure(level=None, queue_size=10000, handlers=None):
+    """Route root logging through a bounded queue to a background writer
+
+    Any logging previously set up by this function is replaced.
+
+    :param level: name of the root log level, defaults to the LOG_LEVEL
+        environment variable or INFO, which is also used in place of an
+        unknown level name
+    :param queue_size: maximum records waiting to be written before new
+        records are dropped
+    :param handlers: handlers to write records with, defaults to a stream
+        handler on stderr
+    :return: the :class:`QueueHandler` installed on the root logger
+    """
+    level_name = (level or os.environ.get('LOG_LEVEL', 'INFO')).upper()
+    level = logging.getLevelName(level_name)
+    is_known_level = isinstance(level, int)
+    if not is_known_level:
+        level = logging.INFO
+    if not handlers:
+        stream = logging.StreamHandler()
+        stream.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+        handlers = [stream]
+
+    unconfigure()
+    records = queue.Queue(queue_size)
+    listener = QueueListener(records, *handlers)
+    handler = QueueHandler(records, listener)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(handler)
+    listener.start()
+
+    if not is_known_level:
+        LOG.warning('Unknown log level [%s], using INFO', level_name)
+
+    _configured['handler'] = handler
+    _configured['listener'] = listener
+    return handler
+
+
+def unconfigure():
+    """Remove logging set up by configure, writing out any queued records
+    """
+    handler = _configured.pop('handler', None)
+    if handler:
+        logging.getLogger().removeHandler(handler)
+    listener = _configured.pop('listener', None)
+    if listener:
+        listener.stop()
+
+
+atexit.register(unconfigure)
@@ -53,6 +53,22 @@ def test_with_preload(engine, loader):
     assert_that(engine.get('testhit'), not_none())
 
 
+def test_get_from_buckets(engine, loader):
+    cache = caching.FactCache(engine, 'test', loader=loader, buckets=4)
+    cache.warm()
+    assert_that(cache.get('list'), equal_to([1, 2, 3]))
+    assert_that(engine.get('testlist'), none())
+    assert_that(len(engine.keys('test#*')), less_than_or_equal_to(4))
+
+
+def test_buckets_expire(engine, loader):
+    cache = caching.FactCache(engine, 'test', timeout_seconds=60,
+                              buckets=4)
+    cache.set('hit', True)
+    bucket_key = cache._bucket_key('hit')
+    assert_that(engine.ttl(bucket_key), greater_than(0))
+
+
 def wait_for(cache):
     while cache.is_loading:
         time.sleep(0.01)  # 10 ms
@@ -1,4 +1,6 @@
 import basil_common.caching as caching
+import mock
+import pytest
 import time
 
 from tests import *
@@ -39,15 +41,121 @@ class TestFactCache(object):
             cache.load({str(n): ' == ' + str(n) for n in range(0, 10)})
             assert_that(engine.setex.call_count, equal_to(10))
 
+    def test_warm(self, mocker):
+        with mocker.patch('redis.StrictRedis') as engine:
+            cache = self._cache_with_mock_engine(engine, preload=False)
+            cache.warm()
+            assert_that(engine.setex.call_count, equal_to(20))
+            assert_that(cache.is_loading, is_(False))
+
+    def test_set_in_bucket(self, mocker):
+        with mocker.patch('redis.StrictRedis') as engine:
+            cache = self._cache_with_mock_engine(engine, preload=False,
+                                                 buckets=16)
+            cache['7'] = 'is set'
+            assert_that(engine.setex.call_count, equal_to(0))
+            script = engine.register_script.return_value
+            script.assert_called_once_with(keys=[cache._bucket_key('7')],
+                                           args=['7', 'is set', 3600])
+
+    def test_get_from_bucket(self, mocker):
+        with mocker.patch('redis.StrictRedis') as engine:
+            cache = self._cache_with_mock_engine(engine, preload=False,
+                                                 buckets=16)
+            engine.hget.return_value = 'hit'
+            assert_that(cache['7'], equal_to('hit'))
+            engine.hget.assert_called_once_with(cache._bucket_key('7'), '7')
+            assert_that(engine.get.call_count, equal_to(0))
+
+    def test_load_buckets(self, mocker):
+        with mocker.patch('redis.StrictRedis') as engine:
+            cache = self._cache_with_mock_engine(engine, preload=False,
+                                                 buckets=4)
+            cache.load({str(n): ' == ' + str(n) for n in range(0, 10)})
+            pipe = engine.pipeline.return_value
+            assert_that(pipe.execute.call_count, equal_to(1))
+            assert_that(pipe.hmset.call_count, less_than_or_equal_to(4))
+            assert_that(engine.setex.call_count, equal_to(0))
+
+    def test_bucket_key_is_stable(self):
+        cache = caching.FactCache(None, prefix='test_', buckets=16)
+        assert_that(cache._bucket_key(34), equal_to(cache._bucket_key('34')))
+        assert_that(cache._bucket_key(34), starts_with('test_#'))
+
+    def test_bucket_key_same_on_every_python(self):
+        cache = caching.FactCache(None, prefix='test_', buckets=10)
+        assert_that(cache._bucket_key('34'), equal_to('test_#2'))
+        assert_that(cache._bucket_key(b'Jita \xc3\xa9'),
+                    equal_to(cache._bucket_key(u'Jita \xe9')))
+
     @staticmethod
-    def _cache_with_mock_engine(engine, preload=True):
+    def _cache_with_mock_engine(engine, preload=True, buckets=None):
         def loads():
             return {str(n): 'is ' + str(n) for n in range(0, 20)}
         cache = caching.FactCache(engine, prefix='test_', loader=loads,
-                                  preload=preload)
+                                  preload=preload, buckets=buckets)
         return cache
 
     @staticmethod
     def _wait_until_loaded(cache):
         while cache.is_loading:
             time.sleep(0.01)  # 10 ms
+
+
+class TestCacheWarmer(object):
+    def test_warms_every_cache(self):
+        caches = [self._cache('a_'), self._cache('b_'), self._cache('c_')]
+        warmer = caching.CacheWarmer(caches, workers=2).start()
+        assert_that(warmer.wait(timeout=5, critical_only=False), is_(True))
+        assert_that(warmer.is_ready, is_(True))
+        for cache in caches:
+            cache.warm.assert_called_once_with()
+        assert_that(warmer.timings, has_entries({'a_': greater_than(0),
+                                                 'b_': greater_than(0),
+                                                 'c_': greater_than(0)}))
+
+    def test_ready_after_critical_caches(self):
+        slow = self._cache('slow_', delay=0.5)
+        fast = self._cache('fast_')
+        warmer = caching.CacheWarmer([slow, fast], critical=['fast_'],
+                                     workers=2).start()
+        assert_that(warmer.wait(timeout=5), is_(True))
+        assert_that(warmer.is_complete, is_(False))
+        assert_that(warmer.wait(timeout=5, critical_only=False), is_(True))
+
+    def test_reports_failures(self):
+        broken = self._cache('broken_')
+        broken.warm.side_effect = ValueError('no data')
+        warmer = caching.CacheWarmer([broken, self._cache('ok_')],
+                                     critical=['ok_'], backoff=0).start()
+        assert_that(warmer.wait(timeout=5, critical_only=False), is_(True))
+        assert_that(warmer.is_ready, is_(True))
+        assert_that(warmer.report['failures'],
+                    equal_to({'broken_': 'no data'}))
+
+    def test_not_ready_when_critical_fails(self):
+        broken = self._cache('broken_')
+        broken.warm.side_effect = ValueError('no data')
+        warmer = caching.CacheWarmer([broken], retries=2, backoff=0).start()
+        assert_that(warmer.wait(timeout=5, critical_only=False), is_(True))
+        assert_that(warmer.is_ready, is_(False))
+        assert_that(broken.warm.call_count, equal_to(3))
+
+    def test_retries_failed_critical_cache(self):
+        flaky = self._cache('flaky_')
+        flaky.warm.side_effect = [ValueError('redis down'), None]
+        warmer = caching.CacheWarmer([flaky], backoff=0.01).start()
+        assert_that(warmer.wait(timeout=5), is_(True))
+        assert_that(flaky.warm.call_count, equal_to(2))
+        assert_that(warmer.report['failures'], equal_to({}))
+
+    def test_unknown_critical_prefix(self):
+        with pytest.raises(ValueError):
+            caching.CacheWarmer([self._cache('a_')], critical=['typo_'])
+
+    @staticmethod
+    def _cache(prefix, delay=0.01):
+        cache = mock.Mock()
+        cache.prefix = prefix
+        cache.warm.side_effect = lambda: time.sleep(delay)
+        return cache
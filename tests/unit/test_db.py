@@ -0,0 +1,102 @@
+import datetime
+import decimal
+
+import pytest
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import Integer
+from sqlalchemy import String
+from sqlalchemy.ext.declarative import declarative_base
+
+from basil_common import db
+from tests import *
+
+
+Base = declarative_base()
+
+
+class Station(Base):
+    __tablename__ = 'stations'
+    id = Column(Integer, primary_key=True)
+    region = Column(Integer)
+    name = Column(String(32))
+    founded = Column(DateTime)
+
+
+def test_iterate_in_chunks(session):
+    chunks = list(db.iterate_in_chunks(session.query(Station), chunk_size=4))
+    assert_that([len(c) for c in chunks], equal_to([4, 4, 2]))
+    assert_that([s.id for c in chunks for s in c], equal_to(list(range(10))))
+
+
+def test_keyset_page_walks_all_rows(session):
+    query = session.query(Station)
+    seen = []
+    rows, token = db.keyset_page(query, [Station.id], page_size=4)
+    seen.extend(s.id for s in rows)
+    while token:
+        rows, token = db.keyset_page(query, [Station.id], token=token,
+                                     page_size=4)
+        seen.extend(s.id for s in rows)
+    assert_that(seen, equal_to(list(range(10))))
+
+
+def test_keyset_page_compound_descending(session):
+    columns = [Station.region, Station.id]
+    query = session.query(Station)
+    rows, token = db.keyset_page(query, columns, page_size=6,
+                                 descending=True)
+    rows, token = db.keyset_page(query, columns, token=token, page_size=6,
+                                 descending=True)
+    assert_that([(s.region, s.id) for s in rows],
+                equal_to([(0, 9), (0, 6), (0, 3), (0, 0)]))
+    assert_that(token, none())
+
+
+def test_keyset_page_rejects_bad_token(session):
+    with pytest.raises(ValueError):
+        db.keyset_page(session.query(Station), [Station.id], token='!!')
+
+
+def test_keyset_page_over_timestamps(session):
+    columns = [Station.founded, Station.id]
+    query = session.query(Station)
+    seen = []
+    rows, token = db.keyset_page(query, columns, page_size=2)
+    seen.extend(s.id for s in rows)
+    while token:
+        rows, token = db.keyset_page(query, columns, token=token,
+                                     page_size=2)
+        seen.extend(s.id for s in rows)
+    assert_that(seen, equal_to([7, 8, 9, 4, 5, 6, 1, 2, 3, 0]))
+
+
+def test_token_round_trips_tagged_values():
+    values = [datetime.datetime(2020, 1, 1, 12, 30, 0, 250),
+              datetime.date(2020, 1, 1), decimal.Decimal('10.25'), 3, 'x']
+    token = db._encode_token(values)
+    assert_that(db._decode_token(token, values), equal_to(values))
+
+
+def test_keyset_page_rejects_non_string_token(session):
+    with pytest.raises(ValueError):
+        db.keyset_page(session.query(Station), [Station.id], token=7)
+
+
+def _founded(n):
+    # Several stations share a timestamp, so the id breaks ties
+    return datetime.datetime(2003, 5, 6, 12, 0, 0, 500) + \
+        datetime.timedelta(days=n // 3)
+
+
+@pytest.fixture(scope="function")
+def session(request):
+    engine = db.prepare_storage_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = db.prepare_storage_for_engine(engine)()
+    session.add_all([Station(id=n, region=n % 3, name='Station %d' % n,
+                             founded=_founded(9 - n))
+                     for n in range(10)])
+    session.commit()
+    request.addfinalizer(session.close)
+    return session
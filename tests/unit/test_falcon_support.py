@@ -1,7 +1,12 @@
 import datetime
+import json
 import mock
+import threading
+import time
 
 import falcon
+import falcon.testing
+import pytest
 
 from basil_common import falcon_support
 from tests import *
@@ -90,17 +95,106 @@ def test_respond_201():
     created_resp = mock.Mock()
     headers = {'Foo': '1', 'Bar': '2'}
     falcon_support.respond(created_resp, status=falcon.HTTP_CREATED,
-                           headers=headers, body="Expected")
-    assert_that(created_resp.body, equal_to("Expected"))
-    assert_that(created_resp.set_header.call_count, equal_to(2))
+                           headers=headers, body=b"Expected")
+    assert_that(created_resp.body, equal_to(b"Expected"))
+    assert_that(created_resp.set_header.call_count, equal_to(3))
+    created_resp.set_header.assert_called_with('Content-Length', '8')
     assert_that(created_resp.status, equal_to(falcon.HTTP_CREATED))
 
 
+def test_respond_bytes_unchanged():
+    # pre-encoded bytes are published as the very same object
+    bytes_resp = mock.Mock()
+    body = b'{"id":7}'
+    falcon_support.respond(bytes_resp, body=body)
+    assert_that(bytes_resp.body, same_instance(body))
+    bytes_resp.set_header.assert_called_once_with('Content-Length', '8')
+
+
+def test_respond_encodes_objects():
+    # objects are encoded with the default encoder
+    json_resp = mock.Mock()
+    falcon_support.respond(json_resp, body={'id': 7, 'names': ['a', 'b']})
+    assert_that(json_resp.body, equal_to('{"id":7,"names":["a","b"]}'))
+    assert_that(json_resp.content_type,
+                equal_to(falcon_support.JsonEncoder.content_type))
+    json_resp.set_header.assert_called_once_with('Content-Length', '26')
+
+
+def test_respond_head_sets_length():
+    # a HEAD request reports the length of the body it does not publish
+    head_resp = mock.Mock()
+    falcon_support.respond(head_resp, method='HEAD', body=[1, 2, 3])
+    head_resp.body.assert_not_called()
+    head_resp.set_header.assert_called_once_with('Content-Length', '7')
+
+
+def test_respond_custom_encoder():
+    encoder = mock.Mock()
+    encoder.return_value = u'<id>7</id>'
+    encoder.content_type = 'application/xml'
+    encoder.length.return_value = None
+    xml_resp = mock.Mock()
+    falcon_support.respond(xml_resp, body={'id': 7}, encoder=encoder)
+    encoder.assert_called_once_with({'id': 7})
+    assert_that(xml_resp.body, equal_to(u'<id>7</id>'))
+    assert_that(xml_resp.content_type, equal_to('application/xml'))
+    encoder.length.assert_called_once_with(u'<id>7</id>')
+    xml_resp.set_header.assert_not_called()
+
+
+def test_respond_function_encoder():
+    # a plain function may be used as the encoder
+    json_resp = mock.Mock()
+    falcon_support.respond(json_resp, body={'id': 7}, encoder=json.dumps)
+    assert_that(json_resp.body, equal_to('{"id": 7}'))
+    assert_that(json_resp.content_type,
+                equal_to(falcon_support.JsonEncoder.content_type))
+    json_resp.set_header.assert_not_called()
+
+
+def test_respond_function_encoder_bytes():
+    # the length of bytes returned by a plain function encoder is known
+    bytes_resp = mock.Mock()
+    falcon_support.respond(bytes_resp, body={'id': 7},
+                           encoder=lambda obj: b'{"id":7}')
+    assert_that(bytes_resp.body, equal_to(b'{"id":7}'))
+    bytes_resp.set_header.assert_called_once_with('Content-Length', '8')
+
+
+def test_json_encoder_unknown_length_unless_ascii():
+    encoder = falcon_support.JsonEncoder(ensure_ascii=False)
+    assert_that(encoder.length(encoder({'name': 'Jita'})), none())
+
+
 def test_respond_a():
     pass
 #  and other tests
 
 
+def test_readiness_resource_ready():
+    warmer = mock.Mock()
+    warmer.is_ready = True
+    warmer.report = {'ready': True}
+    req = mock.Mock()
+    req.method = 'GET'
+    resp = mock.Mock()
+    falcon_support.ReadinessResource(warmer).on_get(req, resp)
+    assert_that(resp.status, equal_to(falcon.HTTP_OK))
+    assert_that(resp.body, equal_to('{"ready":true}'))
+
+
+def test_readiness_resource_not_ready():
+    warmer = mock.Mock()
+    warmer.is_ready = False
+    warmer.report = {'ready': False}
+    req = mock.Mock()
+    req.method = 'GET'
+    resp = mock.Mock()
+    falcon_support.ReadinessResource(warmer).on_get(req, resp)
+    assert_that(resp.status, equal_to(falcon.HTTP_SERVICE_UNAVAILABLE))
+
+
 @mock.patch.object(datetime, 'datetime', mock.Mock(wraps=datetime.datetime))
 def test_cache_control_middleware_sets_headers_by_status():
     expected_date = 'Tue, 15 Nov 1994 12:45:26 GMT'
@@ -205,3 +299,119 @@ def test_etag_middleware_uncachable_status():
 
     assert_that(resp.etag, has_length(0))
     resp.set_header.assert_not_called()
+
+
+def test_admission_middleware_admits_within_limit():
+    app = _BlockingApp()
+    amw = falcon_support.AdmissionMiddleware(app, concurrency=2)
+    threads = [_call_in_thread(amw, 'GET'), _call_in_thread(amw, 'POST')]
+    _wait_until(lambda: amw.active == 2)
+    app.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert_that(amw.active, equal_to(0))
+    assert_that(amw.queued, equal_to(0))
+    assert_that(app.called, equal_to(['GET', 'POST']))
+
+
+def test_admission_middleware_sheds_when_queue_full():
+    app = _BlockingApp()
+    amw = falcon_support.AdmissionMiddleware(app, concurrency=1,
+                                             queue_size=0, retry_after=5)
+    held = _call_in_thread(amw, 'GET')
+    _wait_until(lambda: amw.active == 1)
+
+    start_response = falcon.testing.StartResponseMock()
+    amw(falcon.testing.create_environ(method='GET'), start_response)
+    assert_that(start_response.status, equal_to(falcon.HTTP_503))
+    assert_that(start_response.headers_dict['Retry-After'], equal_to('5'))
+    assert_that(amw.shed, equal_to(1))
+    # a rejected request gives back no turn
+    assert_that(amw.active, equal_to(1))
+
+    app.release.set()
+    held.join(5)
+    assert_that(app.called, equal_to(['GET']))
+
+
+def test_admission_middleware_sheds_after_queue_timeout():
+    app = _BlockingApp()
+    amw = falcon_support.AdmissionMiddleware(app, concurrency=1,
+                                             queue_timeout=0.01)
+    held = _call_in_thread(amw, 'GET')
+    _wait_until(lambda: amw.active == 1)
+
+    start_response = falcon.testing.StartResponseMock()
+    amw(falcon.testing.create_environ(method='GET'), start_response)
+    assert_that(start_response.status, equal_to(falcon.HTTP_503))
+    assert_that(amw.queued, equal_to(1))
+    assert_that(amw.shed, equal_to(1))
+    assert_that(amw.waiting, equal_to(0))
+
+    app.release.set()
+    held.join(5)
+
+
+def test_admission_middleware_prioritizes_reads():
+    app = _BlockingApp()
+    amw = falcon_support.AdmissionMiddleware(app, concurrency=1,
+                                             queue_timeout=5,
+                                             prioritize_reads=True)
+    threads = [_call_in_thread(amw, 'GET')]
+    _wait_until(lambda: amw.active == 1)
+    threads.append(_call_in_thread(amw, 'POST'))
+    _wait_until(lambda: amw.waiting == 1)
+    threads.append(_call_in_thread(amw, 'GET'))
+    _wait_until(lambda: amw.waiting == 2)
+
+    app.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert_that(app.called, equal_to(['GET', 'GET', 'POST']))
+    assert_that(amw.queued, equal_to(2))
+
+
+def test_admission_middleware_releases_when_error_handler_fails():
+    class Broken(object):
+        def on_get(self, req, resp):
+            raise ValueError('query failed')
+
+    def failing_rollback(ex, req, resp, params):
+        raise RuntimeError('rollback failed')
+
+    api = falcon.API()
+    api.add_route('/broken', Broken())
+    api.add_error_handler(ValueError, failing_rollback)
+    amw = falcon_support.AdmissionMiddleware(api, concurrency=1)
+
+    for n in range(3):
+        with pytest.raises(RuntimeError):
+            amw(falcon.testing.create_environ(path='/broken'),
+                falcon.testing.StartResponseMock())
+        assert_that(amw.active, equal_to(0))
+    assert_that(amw.shed, equal_to(0))
+
+
+class _BlockingApp(object):
+    def __init__(self):
+        self.release = threading.Event()
+        self.called = []
+
+    def __call__(self, env, start_response):
+        self.called.append(env['REQUEST_METHOD'])
+        self.release.wait(5)
+        start_response(falcon.HTTP_200, [])
+        return []
+
+
+def _call_in_thread(app, method):
+    env = falcon.testing.create_environ(method=method)
+    thread = threading.Thread(target=app,
+                              args=(env, falcon.testing.StartResponseMock()))
+    thread.start()
+    return thread
+
+
+def _wait_until(condition):
+    while not condition():
+        time.sleep(0.001)
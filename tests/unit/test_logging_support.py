@@ -0,0 +1,99 @@
+import logging
+import sys
+
+import mock
+
+from basil_common import logging_support
+from basil_common.compat import queue
+from tests import *
+
+
+def _record(msg, *args):
+    return logging.LogRecord('test', logging.INFO, __file__, 1, msg, args,
+                             None)
+
+
+def test_queue_handler_renders_message():
+    records = queue.Queue(1)
+    handler = logging_support.QueueHandler(records)
+    handler.emit(_record('Cache Hit [%s] for key [%s]', 'test_', 7))
+    queued = records.get_nowait()
+    assert_that(queued.msg, equal_to('Cache Hit [test_] for key [7]'))
+    assert_that(queued.args, none())
+
+
+def test_queue_handler_drops_when_full():
+    records = queue.Queue(1)
+    handler = logging_support.QueueHandler(records)
+    handler.emit(_record('kept'))
+    handler.emit(_record('dropped'))
+    handler.emit(_record('dropped'))
+    assert_that(records.qsize(), equal_to(1))
+    assert_that(handler.dropped, equal_to(2))
+
+
+def test_queue_listener_writes_on_stop():
+    records = queue.Queue()
+    target = mock.Mock()
+    target.level = logging.NOTSET
+    listener = logging_support.QueueListener(records, target)
+    listener.start()
+    records.put(_record('written'))
+    listener.stop()
+    assert_that(target.handle.call_count, equal_to(1))
+
+
+def test_configure_level_from_environment():
+    target = mock.Mock()
+    target.level = logging.NOTSET
+    with mock.patch.dict('os.environ', {'LOG_LEVEL': 'warning'}):
+        handler = logging_support.configure(handlers=[target])
+    try:
+        root = logging.getLogger()
+        assert_that(root.level, equal_to(logging.WARNING))
+        assert_that(root.handlers, has_item(handler))
+    finally:
+        logging_support.unconfigure()
+    assert_that(root.handlers, is_not(has_item(handler)))
+
+
+def test_queue_handler_renders_exception_once():
+    records = queue.Queue(1)
+    handler = logging_support.QueueHandler(records)
+    try:
+        raise ValueError('no data')
+    except ValueError:
+        record = _record('Cache warm up failed')
+        record.exc_info = sys.exc_info()
+    handler.emit(record)
+    queued = records.get_nowait()
+
+    written = logging.Formatter().format(queued)
+    assert_that(written.count('Traceback'), equal_to(1))
+    # the original record is left intact for other handlers
+    assert_that(record.exc_info, not_none())
+    assert_that(queued, is_not(same_instance(record)))
+
+
+def test_queue_handler_restarts_listener_after_fork():
+    records = queue.Queue(1)
+    listener = mock.Mock()
+    handler = logging_support.QueueHandler(records, listener)
+    handler._pid = -1
+    handler.emit(_record('in the child'))
+    restarted = listener.restart.call_args[0][0]
+    assert_that(restarted, is_not(same_instance(records)))
+    assert_that(restarted.get_nowait().msg, equal_to('in the child'))
+
+
+def test_configure_unknown_level_uses_info():
+    target = mock.Mock()
+    target.level = logging.NOTSET
+    with mock.patch.dict('os.environ', {'LOG_LEVEL': 'chatty'}):
+        logging_support.configure(handlers=[target])
+    try:
+        assert_that(logging.getLogger().level, equal_to(logging.INFO))
+    finally:
+        logging_support.unconfigure()
+    warned = target.handle.call_args[0][0]
+    assert_that(warned.levelno, equal_to(logging.WARNING))